@@ -7,7 +7,8 @@ container class - ID3FrameStream and they also managed.
 
 """
 
-import re
+import codecs
+import os
 import struct
 
 from mp3_tagger.genres import GENRES
@@ -17,6 +18,65 @@ from mp3_tagger.exceptions import TagSetError, FrameInitError
 __all__ = ['ID3FrameStream', 'VERSION_1', 'VERSION_2', 'VERSION_BOTH']
 
 
+def unpack_synchsafe(bytes_):
+    """Unpacks four byte synchsafe integer (7 bits per byte).
+
+    :param bytes_: byte string;
+    :return: int.
+
+    """
+    return (bytes_[0] & 0x7f) << 21 | (bytes_[1] & 0x7f) << 14 | \
+        (bytes_[2] & 0x7f) << 7 | (bytes_[3] & 0x7f)
+
+
+def pack_synchsafe(int_):
+    """Packs integer to four byte synchsafe string.
+
+    :param int_: int;
+    :return: byte string.
+
+    """
+    return bytes((
+        (int_ >> 21) & 0x7f, (int_ >> 14) & 0x7f, (int_ >> 7) & 0x7f,
+        int_ & 0x7f
+    ))
+
+
+def decode(bytes_, encoding):
+    """Decodes tag payload.
+
+    For UTF-8, UTF-16 and ISO-8859-1 str() goes straight to the C decoder,
+    UTF-16BE has no such fast path and is decoded with the codec function
+    to skip codec registry lookup.
+
+    :param bytes_: byte string or buffer;
+    :param encoding: defined in ID3FrameV2.ENCODING dict;
+    :return: str.
+
+    """
+    if encoding == 'UTF-16BE':
+        return codecs.utf_16_be_decode(bytes_, 'strict', True)[0]
+    return str(bytes_, encoding)
+
+
+def search_int(str_, default=None):
+    """Finds the first run of digits in string, e.g. genre refinement
+    like '(17)'.
+
+    :param str_: str;
+    :param default: returned if there are no digits;
+    :return: int.
+
+    """
+    digits = ''
+    for char in str_:
+        if char.isdecimal():
+            digits += char
+        elif digits:
+            break
+    return int(digits) if digits else default
+
+
 class ID3Tag(object):
     """Base class for ID3TagV1 and ID3TagV2."""
 
@@ -24,7 +84,7 @@ class ID3Tag(object):
         """Initial instance.
 
         :param title: tag name;
-        :param bytes_: byte string;
+        :param bytes_: byte string or memoryview;
         :param encoding: defined in ENCODING dict.
 
         """
@@ -32,30 +92,45 @@ class ID3Tag(object):
         self.bytes_ = bytes_
         self.encoding = encoding
         self.replace_bytes = None
+        self._value = None
+        self._is_cached = False
 
     @property
     def value(self):
-        """Tag value getter."""
+        """Tag value getter. Value is unpacked once and cached until
+        the byte value is changed.
 
-        val = self._unpack_bytes()
-        if self.title == 'genre' and isinstance(val, int):
-            try:
-                val = GENRES[val]
-            except KeyError:
-                val = None
-        val = val if val else None
-        return val
+        """
+        if not self._is_cached:
+            self._value = self._get_value()
+            self._is_cached = True
+        return self._value
 
     @value.setter
     def value(self, value):
         """Tag value setter."""
+
         self.replace_bytes = value
+        self._is_cached = False
 
     def update_attr(self):
         """Update byte values."""
 
         self.bytes_ = self.replace_bytes
         self.replace_bytes = None
+        self._is_cached = False
+
+    def _get_value(self):
+        """Unpacks tag value."""
+
+        val = self._unpack_bytes()
+        if self.title == 'genre' and isinstance(val, int):
+            try:
+                val = GENRES[val]
+            except KeyError:
+                val = None
+        val = val if val else None
+        return val
 
     def _unpack_bytes(self):
         """Stub method."""
@@ -114,12 +189,7 @@ class ID3TagV1(ID3Tag):
             val = struct.pack('>B', value)
         else:
             val = str(value).encode()
-        while len(val) != self._len:
-            if len(val) < self._len:
-                val += b'\x00'
-            else:
-                val = val[:-1]
-        return val
+        return val[:self._len].ljust(self._len, b'\x00')
 
     def _unpack_bytes(self):
         """Gets payload."""
@@ -128,9 +198,9 @@ class ID3TagV1(ID3Tag):
             val = struct.unpack('>B', self.bytes_)[0]
         else:
             try:
-                val = self.bytes_.decode()
+                val = decode(self.bytes_, self.encoding)
             except UnicodeDecodeError:
-                val = self.bytes_.decode('CP1251')
+                val = decode(self.bytes_, 'CP1251')
             if '\x00' in val:
                 val = val.replace('\x00', '')
         return val
@@ -170,21 +240,18 @@ class ID3TagV2(ID3Tag):
 
         val = None
         try:
-            val = self.bytes_.decode(self.encoding)
+            val = decode(self.bytes_, self.encoding)
         except UnicodeDecodeError:
             if self.title == 'comment':
-                val = self.bytes_[3:].decode(self.encoding)
+                val = decode(self.bytes_[3:], self.encoding)
                 val = val.replace('\x00', '')
         if self.title == 'genre':
             try:
                 val = int(val)
             except ValueError:
-                if re.match(r'\w+', val):
-                    pass
-                else:
-                    search_match = re.search(r'\d+', val)
-                    if search_match:
-                        val = int(search_match.group(0))
+                first_char = val[:1]
+                if not (first_char.isalnum() or first_char == '_'):
+                    val = search_int(val, val)
         return val
 
 # Versions for filter tags.
@@ -221,27 +288,24 @@ class ID3FrameV1(ID3Frame):
 
      """
 
-    OFFSET = {
-        'song': (3, 30),
-        'artist': (33, 30),
-        'album': (63, 30),
-        'year': (93, 4),
-        'comment': (97, 28),
-        'null_byte': (125, 1),
-        'track': (126, 1),
-        'genre': (127, 1)
-    }
+    # Tag title, offset and length. Null byte at offset 125 is skipped.
+    OFFSET = (
+        ('song', 3, 30),
+        ('artist', 33, 30),
+        ('album', 63, 30),
+        ('year', 93, 4),
+        ('comment', 97, 28),
+        ('track', 126, 1),
+        ('genre', 127, 1)
+    )
 
     def __init__(self, bytes_):
         super(ID3FrameV1, self).__init__(bytes_)
-        self.tags = []
         self.title = 'TAG'
-        for tag_title in self.OFFSET:
-            offset, len_ = self.OFFSET[tag_title]
-            tag_bytes = self.bytes_[offset:offset + len_]
-            if tag_title != 'null_byte':
-                tag = ID3TagV1(tag_title, tag_bytes)
-                self.tags.append(tag)
+        self.tags = [
+            ID3TagV1(tag_title, self.bytes_[offset:offset + len_])
+            for tag_title, offset, len_ in self.OFFSET
+        ]
 
     def update(self, *args):
         """Updates byte string from tags."""
@@ -288,11 +352,16 @@ class ID3FrameV2(ID3Frame):
         'WXXX': 'url'
     }
 
-    OFFSET = {
-        'title': (0, 4),
-        'data_len': (4, 8),
-        'flags': (8, 10),
-    }
+    # Frame title for a new tag. Year is always written to TDRC.
+    TAG_TO_FRAME = {tag: frame for frame, tag in FRAMES.items()}
+    TAG_TO_FRAME['year'] = 'TDRC'
+
+    # Header field, offset and length.
+    OFFSET = (
+        ('title', 0, 4),
+        ('data_len', 4, 4),
+        ('flags', 8, 2)
+    )
 
     ENCODING = {
         0: 'ISO-8859-1',
@@ -301,24 +370,30 @@ class ID3FrameV2(ID3Frame):
         3: 'UTF-8'
     }
 
-    def __init__(self, bytes_):
+    def __init__(self, bytes_, version='2.3'):
         """Initial instance.
 
         The difference from the first version of the frame that this frame
         contains the header, meta data and the tag.
 
+        :param bytes_: byte string or memoryview;
+        :param version: ID3 version, in 2.4 payload length is synchsafe.
+
         """
         super(ID3FrameV2, self).__init__(bytes_)
+        self.version = version
         self.title = None
         self.data_len = None
         self.flags = None
         self.to_remove = False
         self.to_insert = False
-        for meta, offset in self.OFFSET.items():
-            setattr(self, meta, self.bytes_[offset[0]:offset[1]])
+        self.position = None
+        for meta, offset, len_ in self.OFFSET:
+            setattr(self, meta, self.bytes_[offset:offset + len_])
+        self.title = bytes(self.title)
         self.encoding = self.bytes_[self.HEADER_LEN:self.HEADER_LEN + 1]
         tag_title = self.FRAMES[self.title.decode()]
-        encode_index = struct.unpack('>B', self.encoding)[0]
+        encode_index = self.encoding[0]
         if encode_index in self.ENCODING:
             tag_encode = self.ENCODING[encode_index]
             self.tags = ID3TagV2(
@@ -331,13 +406,11 @@ class ID3FrameV2(ID3Frame):
         """Updates byte string from tags."""
 
         if self.tags.replace_bytes:
-            b_str = b''
             self.data_len = self._get_data_len(
-                self.tags.replace_bytes, self.encoding
+                self.tags.replace_bytes, self.encoding, self.version
             )
-            for meta in (self.title, self.data_len, self.flags, self.encoding):
-                b_str += meta
-            bytes_ = b_str + self.tags.replace_bytes
+            bytes_ = b''.join((self.title, self.data_len, self.flags,
+                               self.encoding, self.tags.replace_bytes))
             self.tags.update_attr()
             super(ID3FrameV2, self).update(bytes_)
         elif self.tags.to_remove:
@@ -347,43 +420,34 @@ class ID3FrameV2(ID3Frame):
             self.tags.to_insert = False
 
     @staticmethod
-    def _get_data_len(bytes_, encoding):
+    def _get_data_len(bytes_, encoding, version):
         """Packs four byte string which defines the payload length."""
 
-        len_ = len(encoding + bytes_)
-        return struct.pack('>i', len_)
+        len_ = len(encoding) + len(bytes_)
+        if version == '2.4':
+            return pack_synchsafe(len_)
+        return len_.to_bytes(4, 'big')
 
     @classmethod
     def from_str(cls, title, val, version):
         """Creates an instance of the data payload."""
 
-        if title in cls.FRAMES.values():
-            for frame_title, tag_title in cls.FRAMES.items():
-                if title == 'year':
-                    frame_title = 'TDRC'
-                    break
-                if title == tag_title:
-                    break
-            else:
-                raise TagSetError("Tag %s can't be set" % title)
-            if title == 'url':
-                encoding_byte = b'\x00'
-            else:
-                encoding_byte = b'\x03' if version == '2.4' else b'\x01'
-            encoding = cls.ENCODING[struct.unpack('>B', encoding_byte)[0]]
-            if title == 'comment':
-                data = b'eng' + val.encode(encoding)
-            else:
-                data = val.encode(encoding)
-            data_len = cls._get_data_len(data, encoding_byte)
-            bytes_ = b'' + frame_title.encode()
-            for field in (data_len, b'\x00\x00', encoding_byte, data):
-                if isinstance(field, str):
-                    field = field.encode(encoding)
-                bytes_ += field
-        else:
+        frame_title = cls.TAG_TO_FRAME.get(title)
+        if frame_title is None:
             raise TagSetError("Tag %s can't be set" % title)
-        frame_obj = cls(bytes_)
+        if title == 'url':
+            encoding_byte = b'\x00'
+        else:
+            encoding_byte = b'\x03' if version == '2.4' else b'\x01'
+        encoding = cls.ENCODING[encoding_byte[0]]
+        if title == 'comment':
+            data = b'eng' + val.encode(encoding)
+        else:
+            data = val.encode(encoding)
+        data_len = cls._get_data_len(data, encoding_byte, version)
+        bytes_ = b''.join((frame_title.encode(), data_len, b'\x00\x00',
+                           encoding_byte, data))
+        frame_obj = cls(bytes_, version)
         frame_obj.tags.to_insert = True
         return frame_obj
 
@@ -394,14 +458,41 @@ class ID3FrameV2(ID3Frame):
 class ID3FrameStream(object):
     """The class is a container of frames."""
 
-    def __init__(self, bytes_):
+    HEADER_LEN = 10
+    V1_LEN = 128
+
+    def __init__(self, v2_bytes, v1_bytes):
         """Initial instance.
 
-        :param bytes_: bytes from file.
+        :param v2_bytes: ID3v2 header and tag area from the file start;
+        :param v1_bytes: last 128 bytes from file (ID3v1 block).
 
         """
-        self.bytes_ = bytes_
+        self.v2_bytes = v2_bytes
+        self.v1_bytes = v1_bytes
+        # Lengths of ID3 data as stored in the file, updated only after
+        # the data is written.
+        self.stored_v2_len = len(v2_bytes)
+        self.stored_v1_len = len(v1_bytes)
         self.frames = []
+        self.dirty = False
+
+    @classmethod
+    def from_file(cls, stream):
+        """Reads only the regions of the file that contain ID3 data.
+
+        :param stream: file object opened in binary mode;
+        :return: ID3FrameStream instance.
+
+        """
+        header = stream.read(cls.HEADER_LEN)
+        if header[:3] == b'ID3':
+            v2_bytes = header + stream.read(unpack_synchsafe(header[6:10]))
+        else:
+            v2_bytes = b''
+        stream.seek(0, os.SEEK_END)
+        stream.seek(max(stream.tell() - cls.V1_LEN, len(v2_bytes)))
+        return cls(v2_bytes, stream.read(cls.V1_LEN))
 
     def _get_frames(self):
         """Gets list all frames."""
@@ -411,33 +502,52 @@ class ID3FrameStream(object):
         return self.frames
 
     def update_stream(self):
-        """Updates, changes or deletes frames in bytes_ attribute."""
+        """Updates, changes or deletes frames in v2_bytes and v1_bytes
+        attributes.
 
-        for frame in self._get_changed_frame():
-            if frame.to_remove:
-                self.bytes_ = self.bytes_.replace(frame.bytes_, b'')
-                self.frames.remove(frame)
-                del frame
-                continue
-            elif frame.to_insert:
-                self._insert_frame(frame)
-                continue
-            self.bytes_ = self.bytes_.replace(
-                frame.bytes_, frame.replace_bytes
-            )
-            frame.bytes_ = frame.replace_bytes
-            frame.replace_bytes = None
-        return self.bytes_
+        The ID3v2 tag area is rebuilt in one pass: inserted frames go right
+        after the header and extended header, then parsed frames in the file
+        order. Bytes between parsed frames (unknown frames, padding) are kept
+        as is.
 
-    def _get_changed_frame(self):
-        """Gets list of changed frames."""
+        :return: tuple of ID3v2 and ID3v1 byte strings.
 
+        """
         self.update_frames()
-        return list(
-            filter(lambda frame:
-                   frame.replace_bytes or frame.to_remove or frame.to_insert,
-                   self.frames)
-        )
+        inserted, parsed = [], []
+        for frame in self.frames:
+            if isinstance(frame, ID3FrameV1):
+                if frame.replace_bytes:
+                    self.v1_bytes = frame.bytes_ = frame.replace_bytes
+                    frame.replace_bytes = None
+            elif frame.position is None:
+                inserted.append(frame)
+            else:
+                parsed.append(frame)
+        parsed.sort(key=lambda frame: frame.position)
+        cursor = self._get_frames_offset()
+        out = bytearray(self.v2_bytes[:cursor])
+        if not out and any(not frame.to_remove for frame in inserted):
+            # File has no ID3v2 tag, new frames need an ID3v2.3 header.
+            out += b'ID3' + bytes((3, 0, 0)) + pack_synchsafe(0)
+        for frame in inserted + parsed:
+            if frame.position is not None:
+                out += self.v2_bytes[cursor:frame.position]
+                cursor = frame.position + len(frame.bytes_)
+            if frame.to_remove:
+                self.frames.remove(frame)
+                continue
+            if frame.replace_bytes:
+                frame.bytes_ = frame.replace_bytes
+                frame.replace_bytes = None
+            frame.position = len(out)
+            frame.to_insert = False
+            out += frame.bytes_
+        out += self.v2_bytes[cursor:]
+        if out[:3] == b'ID3':
+            out[6:10] = pack_synchsafe(len(out) - self.HEADER_LEN)
+        self.v2_bytes = bytes(out)
+        return self.v2_bytes, self.v1_bytes
 
     def update_frames(self):
         """Updates byte value for all frames."""
@@ -458,43 +568,72 @@ class ID3FrameStream(object):
         return tags
 
     def _parse_frames(self):
-        """Frames parser."""
+        """Frames parser.
 
+        Walks the ID3v2 tag area frame by frame, so frame titles inside
+        payloads (e.g. APIC) and audio data are never matched. Frames which
+        are not listed in ID3FrameV2.FRAMES and repeated frames are skipped,
+        parsing stops at padding or at a frame exceeding the tag area.
+
+        """
         frames = []
-        for frame_title in ID3FrameV2.FRAMES:
-            try:
-                frame_start = self.bytes_.index(frame_title.encode())
-            except ValueError:
-                frame_start = None
-            if frame_start:
-                start, end = ID3FrameV2.OFFSET['data_len']
-                data_len = self.bytes_[frame_start + start:frame_start + end]
+        titles = set()
+        header_len = ID3FrameV2.HEADER_LEN
+        version = self.get_id3_version()
+        view = memoryview(self.v2_bytes)
+        pos = self._get_frames_offset()
+        while pos + header_len <= len(self.v2_bytes):
+            frame_title = self.v2_bytes[pos:pos + 4]
+            if not frame_title.isalnum():
+                break
+            data_len = view[pos + 4:pos + 8]
+            if version == '2.4':
+                data_len = unpack_synchsafe(data_len)
+            else:
                 data_len = struct.unpack('>i', data_len)[0]
-                location = (frame_start,
-                            frame_start + ID3FrameV2.HEADER_LEN + data_len)
-                frame_bytes = self.bytes_[location[0]:location[1]]
-                if frame_bytes:
-                    try:
-                        frame = ID3FrameV2(frame_bytes)
-                    except FrameInitError:
-                        pass
-                    else:
-                        frames.append(frame)
-        old_frame = ID3FrameV1(self.bytes_[-128:])
+            frame_end = pos + header_len + data_len
+            if data_len < 0 or frame_end > len(self.v2_bytes):
+                # Corrupted frame size, the rest of the tag area can't be
+                # split into frames.
+                break
+            frame_title = frame_title.decode()
+            if data_len > 0 and frame_title in ID3FrameV2.FRAMES and \
+                    frame_title not in titles:
+                titles.add(frame_title)
+                try:
+                    frame = ID3FrameV2(view[pos:frame_end], version)
+                except FrameInitError:
+                    pass
+                else:
+                    frame.position = pos
+                    frames.append(frame)
+            pos = frame_end
+        old_frame = ID3FrameV1(memoryview(self.v1_bytes))
         frames.append(old_frame)
         return frames
 
+    def _get_frames_offset(self):
+        """Returns offset of the first frame in the ID3v2 tag area, extended
+        header is skipped if present.
+
+        """
+        offset = self.HEADER_LEN
+        if len(self.v2_bytes) >= offset + 4 and self.v2_bytes[5] & 0x40:
+            size = self.v2_bytes[offset:offset + 4]
+            if self.get_id3_version() == '2.4':
+                # Synchsafe, includes the size bytes.
+                offset += unpack_synchsafe(size)
+            else:
+                # Big-endian, excludes the size bytes.
+                offset += 4 + int.from_bytes(size, 'big')
+        return offset
+
     def get_id3_version(self):
         """Returns ID3 version value."""
 
-        if self.bytes_[:3] == b'ID3':
-            subversion = struct.unpack('>2B', self.bytes_[3:5])[0]
+        if self.v2_bytes[:3] == b'ID3':
+            subversion = struct.unpack('>2B', self.v2_bytes[3:5])[0]
             version = '2.%d' % subversion
         else:
             version = '1.1'
         return version
-
-    def _insert_frame(self, frame):
-        """Inserts frame after ID3 header."""
-
-        self.bytes_ = self.bytes_[:10] + frame.bytes_ + self.bytes_[10:]
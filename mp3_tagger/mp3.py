@@ -8,62 +8,96 @@ and helper functions.
 
 import os
 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from stat import S_IWRITE
 
-from mp3_tagger.id3 import ID3FrameStream, ID3FrameV2, VERSION_2, VERSION_BOTH
+from mp3_tagger.id3 import ID3FrameStream, ID3FrameV2, VERSION_1, VERSION_2, \
+    VERSION_BOTH
 from mp3_tagger.exceptions import MP3OpenFileError, TagSetError
 
 
-def val_getter(func):
-    """Decorator getter."""
+def val_getter(attr):
+    """Makes getter for tag value.
 
-    def wrapper(self):
-        attr = func.__name__
+    :param attr: tag title;
+    :return: function.
+
+    """
+    def getter(self):
         tags = self._get_tags(attr)
         if len(tags) == 1:
             tags = tags[0].value
-        return func(self, tags)
-    return wrapper
+        return tags
+    return getter
+
 
+def val_setter(attr):
+    """Makes setter for tag value.
 
-def val_setter(func):
-    """Decorator setter."""
+    :param attr: tag title;
+    :return: function.
 
-    def wrapper(self, val):
-        attr = func.__name__
+    """
+    def setter(self, val):
         if attr == 'genre' and self._tag_version is VERSION_BOTH:
             raise TagSetError('Genre tag not supports multiple version set')
         tags = self._get_tags(attr)
-        v2_null = len(tags) == 0 and self._tag_version is VERSION_2
-        v2_null_both = self._tag_version is VERSION_BOTH and (
-            len(tags) in (0, 1)
-        )
-        if v2_null or v2_null_both:
+        v2_null = self._tag_version is not VERSION_1 and \
+            not self._tags_index[VERSION_2].get(attr)
+        if v2_null:
             frame = ID3FrameV2.from_str(attr, val, self.id3_version)
             self._frame_stream.frames.append(frame)
+            self._add_tag(frame.tags)
             tags.append(frame.tags)
         for tag in tags:
             tag.value = val
         self._frame_stream.update_frames()
-        return func(self, val)
-    return wrapper
+        self._frame_stream.dirty = True
+    return setter
 
 
-def val_deleter(func):
-    """Decorator deleter."""
+def val_deleter(attr):
+    """Makes deleter for tag value.
 
-    def wrapper(self):
-        attr = func.__name__
+    :param attr: tag title;
+    :return: function.
+
+    """
+    def deleter(self):
         tags = self._get_tags(attr)
         for tag in tags:
             del tag.value
         self._frame_stream.update_frames()
-        return func(self)
-    return wrapper
+        if tags:
+            self._frame_stream.dirty = True
+    return deleter
+
+
+def _scan_one(path, version):
+    """Reads tags of one file in a worker process.
+
+    :param path: path to mp3 file;
+    :param version: tag version for get_tags;
+    :return: dict or exception instance if the file can't be read.
+
+    """
+    MP3File.set_version(version)
+    try:
+        return MP3File(path).get_tags()
+    except Exception as exc:
+        return exc
 
 
 class MP3File(object):
-    """Class - based interface to ID3."""
+    """Class - based interface to ID3.
+
+    Tag values are accessed via properties named as in TAGS.
+
+    """
+
+    TAGS = ('artist', 'album', 'song', 'track', 'comment', 'genre', 'year',
+            'band', 'composer', 'copyright', 'url', 'publisher')
 
     _tag_version = VERSION_BOTH
 
@@ -74,55 +108,66 @@ class MP3File(object):
 
         """
         self.path = path
-        self._frame_stream = ID3FrameStream(self.open())
+        self._frame_stream = self.open()
         self.id3_version = self._frame_stream.get_id3_version()
-        self._tags = self._frame_stream.get_tags()
+        self._tags = []
+        self._tags_index = {VERSION_1: {}, VERSION_2: {}}
+        for tag in self._frame_stream.get_tags():
+            self._add_tag(tag)
 
     def open(self):
-        """Reads file.
+        """Reads ID3v2 tag area from the file start and ID3v1 block from
+        the file end. Audio data is not read.
 
-        :return: byte string.
+        :return: ID3FrameStream instance.
 
         """
-        if self.path.endswith('.mp3'):
-            try:
-                stream = open(self.path, 'r+b')
-            except PermissionError:
-                os.chmod(self.path, S_IWRITE)
-                stream = open(self.path, 'r+b')
-        else:
+        if not self.path.endswith('.mp3'):
             raise MP3OpenFileError('File must be MP3 format')
-        data = stream.read()
-        stream.close()
-        return data
+        with self._open_read() as stream:
+            return ID3FrameStream.from_file(stream)
 
-    @staticmethod
-    def _filter_title(tags, title):
-        """Filter tags by title.
+    def _open_read(self):
+        """Opens file for reading, write access is not requested.
 
-        :param tags: list of tags;
-        :param title: tag title;
-        :return: filtered list.
+        :return: file object.
 
         """
-        return list(
-            filter(lambda tag: getattr(tag, 'title') == title, tags)
-        )
+        return open(self.path, 'rb')
 
-    def _filter_version(self):
-        """Filter tags by version.
+    def _open_write(self):
+        """Opens file for reading and writing, adds write permission
+        if the file is read-only.
 
-        :return: filtered list.
+        :return: file object.
 
         """
-        return list(
-            filter(lambda tag: isinstance(tag, self._tag_version), self._tags)
-        )
+        try:
+            return open(self.path, 'r+b')
+        except PermissionError:
+            os.chmod(self.path, os.stat(self.path).st_mode | S_IWRITE)
+            return open(self.path, 'r+b')
+
+    def _add_tag(self, tag):
+        """Adds tag to the list and index of tags.
+
+        :param tag: ID3TagV1 or ID3TagV2 instance.
+
+        """
+        self._tags.append(tag)
+        self._tags_index[type(tag)].setdefault(tag.title, []).append(tag)
 
     def _get_tags(self, title):
-        """Used by decorators."""
+        """Used by decorators.
+
+        :param title: tag title;
+        :return: list of tags of selected version.
 
-        return self._filter_title(self._filter_version(), title)
+        """
+        if self._tag_version is VERSION_BOTH:
+            return self._tags_index[VERSION_2].get(title, []) + \
+                self._tags_index[VERSION_1].get(title, [])
+        return list(self._tags_index[self._tag_version].get(title, []))
 
     def get_tags(self):
         """Get tags.
@@ -130,30 +175,62 @@ class MP3File(object):
         :return: dict.
 
         """
-        tags_dict = {}
-        tags = self._filter_version()
-        try:
-            for class_ in self._tag_version:
-                ver_dict = {}
-                tmp_dict = {}
-                for tag in tags:
-                    if isinstance(tag, class_):
-                        tmp_dict[tag.title] = tag.value
-                ver_dict[class_.__name__] = tmp_dict.copy()
-                tags_dict.update(ver_dict.copy())
-                ver_dict.clear()
-                tmp_dict.clear()
-        except TypeError:
-            for tag in tags:
-                tags_dict.update(tag.to_dict())
-        return tags_dict
+        if self._tag_version is VERSION_BOTH:
+            return {
+                class_.__name__: {tag.title: tag.value for tag in self._tags
+                                  if isinstance(tag, class_)}
+                for class_ in VERSION_BOTH
+            }
+        return {tag.title: tag.value for tag in self._tags
+                if isinstance(tag, self._tag_version)}
 
     def save(self):
-        """Writes updated data to file."""
+        """Writes updated data to file. Does nothing if no tag was set
+        or deleted since the file was read or saved.
 
-        data = self._frame_stream.update_stream()
-        with open(self.path, 'wb') as out_stream:
-            out_stream.write(data)
+        """
+        if not self._frame_stream.dirty:
+            return
+        v2_len = self._frame_stream.stored_v2_len
+        v1_len = self._frame_stream.stored_v1_len
+        # File is opened before frames are rebuilt, so a permission error
+        # leaves the tags state untouched and save can be called again.
+        with self._open_write() as stream:
+            v2_bytes, v1_bytes = self._frame_stream.update_stream()
+            # ID3v2 header is created if the file had only ID3v1.
+            self.id3_version = self._frame_stream.get_id3_version()
+            stream.seek(0, os.SEEK_END)
+            audio_len = stream.tell() - v1_len - v2_len
+            if len(v2_bytes) == v2_len:
+                stream.seek(0)
+                stream.write(v2_bytes)
+            else:
+                stream.seek(v2_len)
+                audio = stream.read(audio_len)
+                stream.seek(0)
+                stream.write(v2_bytes)
+                stream.write(audio)
+            stream.seek(len(v2_bytes) + audio_len)
+            stream.write(v1_bytes)
+            stream.truncate()
+        self._frame_stream.stored_v2_len = len(v2_bytes)
+        self._frame_stream.stored_v1_len = len(v1_bytes)
+        self._frame_stream.dirty = False
+
+    @classmethod
+    def scan_paths(cls, paths, workers=None):
+        """Reads tags of many files in parallel processes.
+
+        :param paths: iterable of paths to mp3 files;
+        :param workers: number of processes, CPU count by default;
+        :return: generator of get_tags dicts in the order of paths, files
+            which can't be read give the raised exception instance instead.
+
+        """
+        with ProcessPoolExecutor(workers) as executor:
+            for tags in executor.map(_scan_one, paths,
+                                     repeat(cls._tag_version), chunksize=64):
+                yield tags
 
     @classmethod
     def set_version(cls, version):
@@ -162,194 +239,35 @@ class MP3File(object):
 
         """
 
-        if version in VERSION_BOTH or version is VERSION_BOTH:
+        # Compared by value, VERSION_BOTH is a new tuple after pickling
+        # (e.g. in scan_paths workers).
+        if version == VERSION_BOTH:
+            cls._tag_version = VERSION_BOTH
+        elif version in VERSION_BOTH:
             cls._tag_version = version
         else:
             raise ValueError('Incorrect version value (may be: id3.VERSION_1, '
                              'id3.VERSION_2 or id3.VERSION_BOTH).')
 
-    @property
-    @val_getter
-    def artist(self, val):
-        return val
-
-    @property
-    @val_getter
-    def album(self, val):
-        return val
-
-    @property
-    @val_getter
-    def song(self, val):
-        return val
-
-    @property
-    @val_getter
-    def track(self, val):
-        return val
-
-    @property
-    @val_getter
-    def comment(self, val):
-        return val
-
-    @property
-    @val_getter
-    def genre(self, val):
-        return val
-
-    @property
-    @val_getter
-    def year(self, val):
-        return val
-
-    @property
-    @val_getter
-    def band(self, val):
-        return val
-
-    @property
-    @val_getter
-    def composer(self, val):
-        return val
-
-    @property
-    @val_getter
-    def copyright(self, val):
-        return val
-
-    @property
-    @val_getter
-    def url(self, val):
-        return val
-
-    @property
-    @val_getter
-    def publisher(self, val):
-        return val
-
-    @artist.setter
-    @val_setter
-    def artist(self, val):
-        pass
-
-    @album.setter
-    @val_setter
-    def album(self, val):
-        pass
-
-    @song.setter
-    @val_setter
-    def song(self, val):
-        pass
-
-    @track.setter
-    @val_setter
-    def track(self, val):
-        pass
-
-    @comment.setter
-    @val_setter
-    def comment(self, val):
-        pass
-
-    @genre.setter
-    @val_setter
-    def genre(self, val):
-        pass
-
-    @year.setter
-    @val_setter
-    def year(self, val):
-        pass
-
-    @band.setter
-    @val_setter
-    def band(self, val):
-        pass
-
-    @composer.setter
-    @val_setter
-    def composer(self, val):
-        pass
-
-    @copyright.setter
-    @val_setter
-    def copyright(self, val):
-        pass
-
-    @url.setter
-    @val_setter
-    def url(self, val):
-        pass
-
-    @publisher.setter
-    @val_setter
-    def publisher(self, val):
-        pass
-
-    @artist.deleter
-    @val_deleter
-    def artist(self):
-        pass
-
-    @album.deleter
-    @val_deleter
-    def album(self):
-        pass
-
-    @song.deleter
-    @val_deleter
-    def song(self):
-        pass
-
-    @track.deleter
-    @val_deleter
-    def track(self):
-        pass
-
-    @comment.deleter
-    @val_deleter
-    def comment(self):
-        pass
-
-    @genre.deleter
-    @val_deleter
-    def genre(self):
-        pass
-
-    @year.deleter
-    @val_deleter
-    def year(self):
-        pass
-
-    @band.deleter
-    @val_deleter
-    def band(self):
-        pass
-
-    @composer.deleter
-    @val_deleter
-    def composer(self):
-        pass
-
-    @copyright.deleter
-    @val_deleter
-    def copyright(self):
-        pass
-
-    @url.deleter
-    @val_deleter
-    def url(self):
-        pass
-
-    @publisher.deleter
-    @val_deleter
-    def publisher(self):
-        pass
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Saves changes unless an exception was raised."""
+
+        if exc_type is None:
+            self.save()
 
     def __str__(self):
         return '%s(%s)' % (self.__class__.__name__, self.path)
 
     def __repr__(self):
         return self.__str__()
+
+
+for _title in MP3File.TAGS:
+    setattr(MP3File, _title, property(
+        val_getter(_title), val_setter(_title), val_deleter(_title),
+        '%s tag value.' % _title
+    ))
+del _title